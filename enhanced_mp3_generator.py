@@ -5,131 +5,120 @@ Enhanced Multi-Genre Music Generator with Direct MP3 Output
 
 import os
 import sys
+import hashlib
+import shutil
 import numpy as np
+import gzip
 import pickle
 import random
-import subprocess
+import concurrent.futures
 from collections import defaultdict
+from types import MappingProxyType
 
-# Import Keras components
-try:
-    from tensorflow.keras.models import Sequential
-    from tensorflow.keras.layers import LSTM, Dense, Dropout, Input
-    from tensorflow.keras.callbacks import ModelCheckpoint
-    from tensorflow.keras.utils import to_categorical
-except ImportError:
-    from keras.models import Sequential
-    from keras.layers import LSTM, Dense, Dropout, Input
-    from keras.callbacks import ModelCheckpoint
-    from keras.utils import to_categorical
+from midi_audio import (as_events, converter_available, render_many_to_mp3,
+                        render_midi_to_mp3, sample_patterns, synth_available, write_midi)
 
-from music21 import converter, instrument, note, chord, stream
-from pydub import AudioSegment
+_CACHE_DIR = os.path.expanduser('~/.cache/mp3_genre')
+
+# Genre characteristics are constant; share one read-only mapping across instances
+_GENRES = MappingProxyType({
+    'jazz': {
+        'folder': 'Jazz',
+        'characteristics': {
+            'tempo_range': (80, 160),
+            'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'C#', 'F#', 'Bb', 'Eb', 'Ab'],
+            'chords': ['Cmaj7', 'Dm7', 'Em7', 'Fmaj7', 'G7', 'Am7', 'Bm7b5', 'C7', 'F7', 'Bb7', 'Eb7', 'Ab7'],
+            'rhythms': ['swing', 'bossa', 'bebop'],
+            'patterns': ['ii-V-I', 'blues', 'rhythm changes'],
+            'instruments': ['Piano', 'Bass', 'Drums', 'Saxophone', 'Trumpet'],
+            'complexity': 'high',
+            'syncopation': True,
+            'blue_notes': True
+        }
+    },
+    'classical': {
+        'folder': 'Classical',
+        'characteristics': {
+            'tempo_range': (60, 180),
+            'scales': ['C', 'G', 'D', 'F', 'Bb', 'A', 'E', 'D'],
+            'chords': ['C', 'G', 'D', 'A', 'F', 'Bb', 'C', 'G', 'D', 'A'],
+            'rhythms': ['common time', 'waltz', 'march'],
+            'patterns': ['Alberti bass', 'arpeggios', 'counterpoint', 'canon'],
+            'instruments': ['Piano', 'Violin', 'Cello', 'Flute', 'Oboe'],
+            'complexity': 'medium',
+            'syncopation': False,
+            'ornaments': ['trill', 'mordent', 'grace note']
+        }
+    },
+    'rock': {
+        'folder': 'Rock',
+        'characteristics': {
+            'tempo_range': (100, 180),
+            'scales': ['A', 'E', 'G', 'D', 'B', 'F#', 'C', 'G'],
+            'chords': ['A5', 'E5', 'D5', 'G5', 'C5', 'F5', 'Am', 'Em', 'Dm', 'G', 'C', 'F'],
+            'rhythms': ['4/4', 'shuffle', 'straight'],
+            'patterns': ['power chords', 'riffs', 'solos', 'verse-chorus'],
+            'instruments': ['Electric Guitar', 'Bass Guitar', 'Drums', 'Keyboard'],
+            'complexity': 'medium',
+            'distortion': True,
+            'power_chords': True
+        }
+    },
+    'electronic': {
+        'folder': 'Electronic',
+        'characteristics': {
+            'tempo_range': (120, 160),
+            'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'C#', 'D#', 'F#'],
+            'chords': ['Cm', 'Dm', 'Em', 'Fm', 'Gm', 'Am', 'Bm', 'Cmaj7', 'Dmaj7', 'Emaj7'],
+            'rhythms': ['4/4', 'syncopated', 'dotted'],
+            'patterns': ['arpeggios', 'pads', 'leads', 'basslines'],
+            'instruments': ['Synthesizer', 'Drum Machine', 'Bass', 'Pad'],
+            'complexity': 'high',
+            'synthesized': True,
+            'electronic': True
+        }
+    },
+    'blues': {
+        'folder': 'Blues',
+        'characteristics': {
+            'tempo_range': (60, 120),
+            'scales': ['A', 'E', 'B', 'G', 'D', 'C', 'F', 'Bb'],
+            'chords': ['A7', 'D7', 'E7', 'B7', 'G7', 'C7', 'F7', 'Bb7', 'Eb7', 'Ab7'],
+            'rhythms': ['12/8', 'shuffle', 'swing'],
+            'patterns': ['12-bar blues', 'turnarounds', 'blue notes'],
+            'instruments': ['Piano', 'Guitar', 'Bass', 'Harmonica'],
+            'complexity': 'medium',
+            'blue_notes': True,
+            'bent_notes': True
+        }
+    },
+    'pop': {
+        'folder': 'Pop',
+        'characteristics': {
+            'tempo_range': (90, 130),
+            'scales': ['C', 'G', 'D', 'A', 'F', 'Bb', 'E', 'B'],
+            'chords': ['C', 'G', 'D', 'A', 'F', 'Bb', 'Am', 'Em', 'Dm', 'Fmaj7', 'G7', 'Cmaj7'],
+            'rhythms': ['4/4', '2/4', 'waltz'],
+            'patterns': ['verse-chorus', 'bridge', 'hook', 'catchy melody'],
+            'instruments': ['Piano', 'Guitar', 'Bass', 'Drums'],
+            'complexity': 'low',
+            'catchy': True,
+            'simple': True
+        }
+    }
+})
 
 class EnhancedMP3Generator:
     def __init__(self):
-        self.genres = {
-            'jazz': {
-                'folder': 'Jazz',
-                'characteristics': {
-                    'tempo_range': (80, 160),
-                    'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'C#', 'F#', 'Bb', 'Eb', 'Ab'],
-                    'chords': ['Cmaj7', 'Dm7', 'Em7', 'Fmaj7', 'G7', 'Am7', 'Bm7b5', 'C7', 'F7', 'Bb7', 'Eb7', 'Ab7'],
-                    'rhythms': ['swing', 'bossa', 'bebop'],
-                    'patterns': ['ii-V-I', 'blues', 'rhythm changes'],
-                    'instruments': ['Piano', 'Bass', 'Drums', 'Saxophone', 'Trumpet'],
-                    'complexity': 'high',
-                    'syncopation': True,
-                    'blue_notes': True
-                }
-            },
-            'classical': {
-                'folder': 'Classical',
-                'characteristics': {
-                    'tempo_range': (60, 180),
-                    'scales': ['C', 'G', 'D', 'F', 'Bb', 'A', 'E', 'D'],
-                    'chords': ['C', 'G', 'D', 'A', 'F', 'Bb', 'C', 'G', 'D', 'A'],
-                    'rhythms': ['common time', 'waltz', 'march'],
-                    'patterns': ['Alberti bass', 'arpeggios', 'counterpoint', 'canon'],
-                    'instruments': ['Piano', 'Violin', 'Cello', 'Flute', 'Oboe'],
-                    'complexity': 'medium',
-                    'syncopation': False,
-                    'ornaments': ['trill', 'mordent', 'grace note']
-                }
-            },
-            'rock': {
-                'folder': 'Rock',
-                'characteristics': {
-                    'tempo_range': (100, 180),
-                    'scales': ['A', 'E', 'G', 'D', 'B', 'F#', 'C', 'G'],
-                    'chords': ['A5', 'E5', 'D5', 'G5', 'C5', 'F5', 'Am', 'Em', 'Dm', 'G', 'C', 'F'],
-                    'rhythms': ['4/4', 'shuffle', 'straight'],
-                    'patterns': ['power chords', 'riffs', 'solos', 'verse-chorus'],
-                    'instruments': ['Electric Guitar', 'Bass Guitar', 'Drums', 'Keyboard'],
-                    'complexity': 'medium',
-                    'distortion': True,
-                    'power_chords': True
-                }
-            },
-            'electronic': {
-                'folder': 'Electronic',
-                'characteristics': {
-                    'tempo_range': (120, 160),
-                    'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'C#', 'D#', 'F#'],
-                    'chords': ['Cm', 'Dm', 'Em', 'Fm', 'Gm', 'Am', 'Bm', 'Cmaj7', 'Dmaj7', 'Emaj7'],
-                    'rhythms': ['4/4', 'syncopated', 'dotted'],
-                    'patterns': ['arpeggios', 'pads', 'leads', 'basslines'],
-                    'instruments': ['Synthesizer', 'Drum Machine', 'Bass', 'Pad'],
-                    'complexity': 'high',
-                    'synthesized': True,
-                    'electronic': True
-                }
-            },
-            'blues': {
-                'folder': 'Blues',
-                'characteristics': {
-                    'tempo_range': (60, 120),
-                    'scales': ['A', 'E', 'B', 'G', 'D', 'C', 'F', 'Bb'],
-                    'chords': ['A7', 'D7', 'E7', 'B7', 'G7', 'C7', 'F7', 'Bb7', 'Eb7', 'Ab7'],
-                    'rhythms': ['12/8', 'shuffle', 'swing'],
-                    'patterns': ['12-bar blues', 'turnarounds', 'blue notes'],
-                    'instruments': ['Piano', 'Guitar', 'Bass', 'Harmonica'],
-                    'complexity': 'medium',
-                    'blue_notes': True,
-                    'bent_notes': True
-                }
-            },
-            'pop': {
-                'folder': 'Pop',
-                'characteristics': {
-                    'tempo_range': (90, 130),
-                    'scales': ['C', 'G', 'D', 'A', 'F', 'Bb', 'E', 'B'],
-                    'chords': ['C', 'G', 'D', 'A', 'F', 'Bb', 'Am', 'Em', 'Dm', 'Fmaj7', 'G7', 'Cmaj7'],
-                    'rhythms': ['4/4', '2/4', 'waltz'],
-                    'patterns': ['verse-chorus', 'bridge', 'hook', 'catchy melody'],
-                    'instruments': ['Piano', 'Guitar', 'Bass', 'Drums'],
-                    'complexity': 'low',
-                    'catchy': True,
-                    'simple': True
-                }
-            }
-        }
+        self.genres = _GENRES
         
         # Check for required dependencies
         self._check_dependencies()
 
     def _check_dependencies(self):
         """Check if required dependencies are available"""
-        try:
-            subprocess.run(['timidity', '--version'], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            self.converter = 'timidity'
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            try:
-                subprocess.run(['fluidsynth', '--version'], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                self.converter = 'fluidsynth'
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                print("Warning: Neither timidity nor fluidsynth found. Please install one of them.")
-                self.converter = None
+        if not converter_available():
+            print("Warning: Neither timidity nor fluidsynth found. Please install one of them.")
 
     def create_genre_datasets(self):
         """Create comprehensive datasets for all genres"""
@@ -144,25 +133,20 @@ class EnhancedMP3Generator:
             
             # Save individual genre dataset
             os.makedirs(f'data/{genre}', exist_ok=True)
-            with open(f'data/{genre}/dataset.pkl', 'wb') as f:
-                pickle.dump(dataset, f)
+            with gzip.open(f'data/{genre}/dataset.pkl.gz', 'wb') as f:
+                pickle.dump(dataset, f, protocol=pickle.HIGHEST_PROTOCOL)
         
         return datasets
 
     def create_genre_specific_dataset(self, genre, info):
         """Create dataset for a specific genre"""
-        notes = []
         characteristics = info['characteristics']
         scales = characteristics['scales']
         chords = characteristics['chords']
         
-        # Generate 1000 notes/chords for each genre
-        for _ in range(1000):
-            if random.random() < 0.7:
-                notes.append(random.choice(scales))
-            else:
-                chord_notes = random.sample(scales, random.randint(2, 4))
-                notes.append('.'.join(chord_notes))
+        # Generate 1000 notes/chords for each genre (70% single notes, 30% chords)
+        notes = [payload if kind == 'n' else '.'.join(payload)
+                 for kind, payload in sample_patterns(scales, 1000, 0.7)]
         
         return {
             'notes': notes,
@@ -181,16 +165,11 @@ class EnhancedMP3Generator:
         info = self.genres[genre]
         characteristics = info['characteristics']
         
-        notes = []
         scales = characteristics['scales']
         chords = characteristics['chords']
         
-        for _ in range(length):
-            if random.random() < 0.6:
-                notes.append(random.choice(scales))
-            else:
-                chord_notes = random.sample(scales, random.randint(2, 4))
-                notes.append('.'.join(chord_notes))
+        # 60% single notes, 40% chords
+        notes = sample_patterns(scales, length, 0.6)
         
         return notes
 
@@ -199,12 +178,18 @@ class EnhancedMP3Generator:
         if filename is None:
             filename = f"{genre}_generated.mp3"
         
+        # Identical note sequences render to identical audio, so reuse earlier renders
+        key = self._cache_key(notes, genre)
+        if self._restore_cached(key, genre, filename):
+            return filename
+        
         # First create MIDI file
         midi_filename = f"{genre}_temp.mid"
         self.create_midi_file(notes, genre, midi_filename)
         
-        # Convert MIDI to MP3
-        self.convert_midi_to_mp3(midi_filename, filename)
+        # Convert MIDI to MP3 (rendered and encoded in memory when possible)
+        if self.convert_midi_to_mp3(midi_filename, filename):
+            self._store_cached(key, filename)
         
         # Clean up temporary MIDI file
         if os.path.exists(midi_filename):
@@ -212,88 +197,103 @@ class EnhancedMP3Generator:
         
         return filename
 
+    def _cache_key(self, notes, genre):
+        """Hash a note sequence and genre into a render-cache key"""
+        return hashlib.sha256((repr(list(as_events(notes))) + genre).encode()).hexdigest()
+
+    def _restore_cached(self, key, genre, filename):
+        """Copy a cached render to filename, returning whether one existed"""
+        cached_file = os.path.join(_CACHE_DIR, f"{key}.mp3")
+        if not os.path.exists(cached_file):
+            return False
+        print(f"Using cached render for {genre}...")
+        shutil.copyfile(cached_file, filename)
+        return True
+
+    def _store_cached(self, key, filename):
+        """Publish a finished render to the cache"""
+        # Go through a temporary file so readers never see a partial MP3
+        os.makedirs(_CACHE_DIR, exist_ok=True)
+        tmp_file = os.path.join(_CACHE_DIR, f"{key}.{os.getpid()}.tmp")
+        shutil.copyfile(filename, tmp_file)
+        os.replace(tmp_file, os.path.join(_CACHE_DIR, f"{key}.mp3"))
+
     def create_midi_file(self, notes, genre, filename=None):
         """Create MIDI file from generated notes (internal use)"""
         if filename is None:
             filename = f"{genre}_generated.mid"
         
-        offset = 0
-        output_notes = []
-        
-        for pattern in notes:
-            if ('.' in pattern) or pattern.isdigit():
-                notes_in_chord = pattern.split('.')
-                chord_notes = []
-                for current_note in notes_in_chord:
-                    try:
-                        new_note = note.Note(int(current_note))
-                    except ValueError:
-                        new_note = note.Note(current_note)
-                    new_note.storedInstrument = instrument.Piano()
-                    chord_notes.append(new_note)
-                new_chord = chord.Chord(chord_notes)
-                new_chord.offset = offset
-                output_notes.append(new_chord)
-            else:
-                new_note = note.Note(pattern)
-                new_note.offset = offset
-                new_note.storedInstrument = instrument.Piano()
-                output_notes.append(new_note)
-            
-            offset += 0.5
-        
-        midi_stream = stream.Stream(output_notes)
-        midi_stream.write('midi', fp=filename)
+        # Emit MIDI messages directly; music21's notation pipeline is overkill here
+        write_midi(as_events(notes), filename)
         
         return filename
 
     def convert_midi_to_mp3(self, midi_file, mp3_file):
         """Convert MIDI to MP3 using available tools"""
-        if not self.converter:
-            print("Error: No MIDI converter available. Please install timidity or fluidsynth.")
-            return False
-        
-        try:
-            if self.converter == 'timidity':
-                print("Using timidity for MIDI to WAV conversion...")
-                wav_file = midi_file.replace('.mid', '.wav')
-                subprocess.run(['timidity', midi_file, '-Ow', '-o', wav_file], check=True)
-                
-                audio = AudioSegment.from_wav(wav_file)
-                audio.export(mp3_file, format="mp3")
-                os.remove(wav_file)
-                
-            elif self.converter == 'fluidsynth':
-                print("Using fluidsynth for MIDI to WAV conversion...")
-                wav_file = midi_file.replace('.mid', '.wav')
-                subprocess.run(['fluidsynth', '-ni', '/usr/share/sounds/sf2/FluidR3_GM.sf2', 
-                              midi_file, '-F', wav_file, '-r', '44100'], check=True)
-                
-                audio = AudioSegment.from_wav(wav_file)
-                audio.export(mp3_file, format="mp3")
-                os.remove(wav_file)
-            
-            return True
-            
-        except Exception as e:
-            print(f"Error during conversion: {e}")
-            return False
+        return render_midi_to_mp3(midi_file, mp3_file)
 
     def generate_all_genres_mp3(self):
         """Generate sample music for all available genres in MP3 format"""
         print("=== Generating MP3 Music for All Genres ===")
         
+        # External synthesizers are cheaper to drive from one shared ffmpeg pass;
+        # in-process synthesizers are built by the workers that render with them
+        if not synth_available():
+            return self._generate_all_genres_mp3_batched()
+        
         generated_files = {}
         
-        for genre in self.genres.keys():
-            notes = self.generate_music_for_genre(genre)
-            if notes:
-                filename = self.create_mp3_file(notes, genre)
+        # Genres are independent, so render them in parallel worker processes
+        max_workers = min(len(self.genres), os.cpu_count() or 1)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                    initializer=_init_worker) as executor:
+            results = dict(zip(self.genres, executor.map(_gen_one, self.genres.keys())))
+        
+        for genre, filename in results.items():
+            if filename:
                 generated_files[genre] = filename
                 print(f"Generated {genre} music: {filename}")
         
         return generated_files
 
+    def _generate_all_genres_mp3_batched(self):
+        """Generate all genres, encoding every cache miss in a single ffmpeg process"""
+        rendered = set()
+        jobs = {}
+        
+        for genre in self.genres.keys():
+            notes = self.generate_music_for_genre(genre)
+            if not notes:
+                continue
+            filename = f"{genre}_generated.mp3"
+            key = self._cache_key(notes, genre)
+            if self._restore_cached(key, genre, filename):
+                rendered.add(genre)
+            else:
+                midi_filename = f"{genre}_temp.mid"
+                self.create_midi_file(notes, genre, midi_filename)
+                jobs[genre] = (key, midi_filename, filename)
+        
+        try:
+            if jobs and render_many_to_mp3([(midi_filename, filename)
+                                            for _, midi_filename, filename in jobs.values()]):
+                for genre, (key, _, filename) in jobs.items():
+                    self._store_cached(key, filename)
+                    rendered.add(genre)
+        finally:
+            # Clean up temporary MIDI files
+            for _, midi_filename, _ in jobs.values():
+                if os.path.exists(midi_filename):
+                    os.remove(midi_filename)
+        
+        generated_files = {}
+        for genre in self.genres.keys():
+            if genre in rendered:
+                generated_files[genre] = f"{genre}_generated.mp3"
+                print(f"Generated {genre} music: {generated_files[genre]}")
+        
+        return generated_files
+
     def list_genres(self):
         """List all available music genres"""
         return list(self.genres.keys())
@@ -304,6 +304,22 @@ class EnhancedMP3Generator:
             return self.genres[genre]
         return None
 
+_worker_generator = None
+
+def _init_worker():
+    """Give each worker process its own generator, synthesizer and random seed"""
+    global _worker_generator
+    # Forked workers inherit the parent's random state; reseed to avoid identical output
+    random.seed(os.getpid())
+    _worker_generator = EnhancedMP3Generator()
+
+def _gen_one(genre):
+    """Generate one genre's MP3 file inside a worker process"""
+    notes = _worker_generator.generate_music_for_genre(genre)
+    if notes:
+        return _worker_generator.create_mp3_file(notes, genre)
+    return None
+
 if __name__ == "__main__":
     generator = EnhancedMP3Generator()
     
@@ -6,76 +6,68 @@ Enhanced Multi-Genre Music Generator with Comprehensive Training Datasets
 import os
 import sys
 import numpy as np
+import gzip
 import pickle
-import random
 from collections import defaultdict
+from types import MappingProxyType
 
-# Import Keras components
-try:
-    from tensorflow.keras.models import Sequential
-    from tensorflow.keras.layers import LSTM, Dense, Dropout, Input
-    from tensorflow.keras.callbacks import ModelCheckpoint
-    from tensorflow.keras.utils import to_categorical
-except ImportError:
-    from keras.models import Sequential
-    from keras.layers import LSTM, Dense, Dropout, Input
-    from keras.callbacks import ModelCheckpoint
-    from keras.utils import to_categorical
+from midi_audio import as_events, render_midi_to_mp3, sample_patterns, write_midi
 
-from music21 import converter, instrument, note, chord, stream
+# Genre characteristics are constant; share one read-only mapping across instances
+_GENRES = MappingProxyType({
+    'jazz': {
+        'folder': 'Jazz',
+        'characteristics': {
+            'tempo_range': (60, 180),
+            'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'C#', 'D#', 'F#', 'G#', 'A#'],
+            'chords': ['C', 'Dm', 'Em', 'F', 'G', 'Am', 'Bdim', 'Cmaj7', 'Dm7', 'Em7', 'Fmaj7', 'G7', 'Am7', 'Bm7b5']
+        }
+    },
+    'classical': {
+        'folder': 'Classical',
+        'characteristics': {
+            'tempo_range': (40, 200),
+            'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B'],
+            'chords': ['C', 'Dm', 'Em', 'F', 'G', 'Am', 'Bdim', 'Cmaj7', 'Dm7', 'Em7']
+        }
+    },
+    'rock': {
+        'folder': 'Rock',
+        'characteristics': {
+            'tempo_range': (80, 200),
+            'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B'],
+            'chords': ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'C5', 'D5', 'E5', 'F5', 'G5', 'A5', 'B5']
+        }
+    },
+    'electronic': {
+        'folder': 'Electronic',
+        'characteristics': {
+            'tempo_range': (100, 180),
+            'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'C#', 'D#', 'F#', 'G#', 'A#'],
+            'chords': ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'Cmaj7', 'Dmaj7', 'Emaj7', 'Fmaj7', 'Gmaj7']
+        }
+    },
+    'blues': {
+        'folder': 'Blues',
+        'characteristics': {
+            'tempo_range': (60, 120),
+            'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B'],
+            'chords': ['C7', 'F7', 'G7', 'Dm7', 'Em7', 'Am7']
+        }
+    },
+    'pop': {
+        'folder': 'Pop',
+        'characteristics': {
+            'tempo_range': (90, 140),
+            'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B'],
+            'chords': ['C', 'Dm', 'Em', 'F', 'G', 'Am', 'Bdim', 'Cmaj7', 'Dm7', 'Em7']
+        }
+    }
+})
 
 class EnhancedMusicGenerator:
     def __init__(self):
-        self.genres = {
-            'jazz': {
-                'folder': 'Jazz',
-                'characteristics': {
-                    'tempo_range': (60, 180),
-                    'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'C#', 'D#', 'F#', 'G#', 'A#'],
-                    'chords': ['C', 'Dm', 'Em', 'F', 'G', 'Am', 'Bdim', 'Cmaj7', 'Dm7', 'Em7', 'Fmaj7', 'G7', 'Am7', 'Bm7b5']
-                }
-            },
-            'classical': {
-                'folder': 'Classical',
-                'characteristics': {
-                    'tempo_range': (40, 200),
-                    'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B'],
-                    'chords': ['C', 'Dm', 'Em', 'F', 'G', 'Am', 'Bdim', 'Cmaj7', 'Dm7', 'Em7']
-                }
-            },
-            'rock': {
-                'folder': 'Rock',
-                'characteristics': {
-                    'tempo_range': (80, 200),
-                    'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B'],
-                    'chords': ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'C5', 'D5', 'E5', 'F5', 'G5', 'A5', 'B5']
-                }
-            },
-            'electronic': {
-                'folder': 'Electronic',
-                'characteristics': {
-                    'tempo_range': (100, 180),
-                    'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'C#', 'D#', 'F#', 'G#', 'A#'],
-                    'chords': ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'Cmaj7', 'Dmaj7', 'Emaj7', 'Fmaj7', 'Gmaj7']
-                }
-            },
-            'blues': {
-                'folder': 'Blues',
-                'characteristics': {
-                    'tempo_range': (60, 120),
-                    'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B'],
-                    'chords': ['C7', 'F7', 'G7', 'Dm7', 'Em7', 'Am7']
-                }
-            },
-            'pop': {
-                'folder': 'Pop',
-                'characteristics': {
-                    'tempo_range': (90, 140),
-                    'scales': ['C', 'D', 'E', 'F', 'G', 'A', 'B'],
-                    'chords': ['C', 'Dm', 'Em', 'F', 'G', 'Am', 'Bdim', 'Cmaj7', 'Dm7', 'Em7']
-                }
-            }
-        }
+        self.genres = _GENRES
 
     def create_genre_datasets(self):
         """Create comprehensive datasets for all genres"""
@@ -90,28 +82,22 @@ class EnhancedMusicGenerator:
             
             # Save individual genre dataset
             os.makedirs(f'data/{genre}', exist_ok=True)
-            with open(f'data/{genre}/dataset.pkl', 'wb') as f:
-                pickle.dump(dataset, f)
+            with gzip.open(f'data/{genre}/dataset.pkl.gz', 'wb') as f:
+                pickle.dump(dataset, f, protocol=pickle.HIGHEST_PROTOCOL)
         
         return datasets
 
     def create_genre_specific_dataset(self, genre, info):
         """Create dataset for a specific genre"""
         # Create synthetic dataset based on genre characteristics
-        notes = []
-        
         # Generate genre-specific patterns
         characteristics = info['characteristics']
         scales = characteristics['scales']
         chords = characteristics['chords']
         
-        # Generate 1000 notes/chords for each genre
-        for _ in range(1000):
-            if random.random() < 0.7:  # 70% single notes
-                notes.append(random.choice(scales))
-            else:  # 30% chords
-                chord_notes = random.sample(scales, random.randint(2, 4))
-                notes.append('.'.join(chord_notes))
+        # Generate 1000 notes/chords for each genre (70% single notes, 30% chords)
+        notes = [payload if kind == 'n' else '.'.join(payload)
+                 for kind, payload in sample_patterns(scales, 1000, 0.7)]
         
         return {
             'notes': notes,
@@ -132,16 +118,11 @@ class EnhancedMusicGenerator:
         characteristics = info['characteristics']
         
         # Generate notes based on genre
-        notes = []
         scales = characteristics['scales']
         chords = characteristics['chords']
         
-        for _ in range(length):
-            if random.random() < 0.6:  # 60% single notes
-                notes.append(random.choice(scales))
-            else:  # 40% chords
-                chord_notes = random.sample(scales, random.randint(2, 4))
-                notes.append('.'.join(chord_notes))
+        # 60% single notes, 40% chords
+        notes = sample_patterns(scales, length, 0.6)
         
         return notes
 
@@ -150,35 +131,8 @@ class EnhancedMusicGenerator:
         if filename is None:
             filename = f"{genre}_generated.mid"
         
-        offset = 0
-        output_notes = []
-        
-        for pattern in notes:
-            if ('.' in pattern) or pattern.isdigit():
-                # Chord
-                notes_in_chord = pattern.split('.')
-                chord_notes = []
-                for current_note in notes_in_chord:
-                    try:
-                        new_note = note.Note(int(current_note))
-                    except ValueError:
-                        new_note = note.Note(current_note)
-                    new_note.storedInstrument = instrument.Piano()
-                    chord_notes.append(new_note)
-                new_chord = chord.Chord(chord_notes)
-                new_chord.offset = offset
-                output_notes.append(new_chord)
-            else:
-                # Single note
-                new_note = note.Note(pattern)
-                new_note.offset = offset
-                new_note.storedInstrument = instrument.Piano()
-                output_notes.append(new_note)
-            
-            offset += 0.5
-        
-        midi_stream = stream.Stream(output_notes)
-        midi_stream.write('midi', fp=filename)
+        # Emit MIDI messages directly; music21's notation pipeline is overkill here
+        write_midi(as_events(notes), filename)
         
         return filename
 
@@ -203,40 +157,7 @@ class EnhancedMusicGenerator:
 
     def convert_midi_to_mp3(self, midi_file, mp3_file):
         """Convert MIDI to MP3 using available tools"""
-        import subprocess
-        from pydub import AudioSegment
-        
-        # Check if timidity is available
-        try:
-            subprocess.run(['timidity', '--version'], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            use_timidity = True
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            use_timidity = False
-        
-        # Check if fluidsynth is available
-        try:
-            subprocess.run(['fluidsynth', '--version'], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            use_fluidsynth = True
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            use_fluidsynth = False
-        
-        if use_timidity:
-            print("Using timidity for MIDI to WAV conversion...")
-            wav_file = midi_file.replace('.mid', '.wav')
-            subprocess.run(['timidity', midi_file, '-Ow', '-o', wav_file], check=True)
-            
-            audio = AudioSegment.from_wav(wav_file)
-            audio.export(mp3_file, format="mp3")
-            os.remove(wav_file)
-            
-        elif use_fluidsynth:
-            print("Using fluidsynth for MIDI to WAV conversion...")
-            wav_file = midi_file.replace('.mid', '.wav')
-            subprocess.run(['fluidsynth', '-ni', '/usr/share/sounds/sf2/FluidR3_GM.sf2', midi_file, '-F', wav_file, '-r', '44100'], check=True)
-            
-            audio = AudioSegment.from_wav(wav_file)
-            audio.export(mp3_file, format="mp3")
-            os.remove(wav_file)
+        return render_midi_to_mp3(midi_file, mp3_file)
 
     def generate_all_genres(self):
         """Generate sample music for all available genres"""
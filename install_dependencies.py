@@ -3,31 +3,42 @@
 Install required dependencies for MP3 music generation
 """
 
+import importlib.util
+import shutil
 import subprocess
 import sys
 import os
 
-def install_package(package):
-    """Install a package using pip"""
+# Distributions whose import name differs from the pip name
+_IMPORT_NAMES = {
+    'ffmpeg-python': 'ffmpeg',
+    'pyfluidsynth': 'fluidsynth',
+}
+
+def need(package):
+    """Check whether a Python package still has to be installed"""
+    name = package.split('==')[0]
+    name = _IMPORT_NAMES.get(name, name.replace('-', '_'))
+    return importlib.util.find_spec(name) is None
+
+def install_packages(packages):
+    """Install packages using a single pip invocation"""
     try:
-        subprocess.check_call([sys.executable, "-m", "pip", "install", package])
+        subprocess.check_call([sys.executable, "-m", "pip", "install",
+                               '--disable-pip-version-check', '--no-input', *packages])
         return True
     except subprocess.CalledProcessError:
         return False
 
 def check_system_package(package):
     """Check if a system package is available"""
-    try:
-        subprocess.run([package, '--version'], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
+    return shutil.which(package) is not None
 
-def install_system_package(package):
-    """Install system package using apt-get"""
+def install_system_packages(packages):
+    """Install system packages using a single apt-get invocation"""
     try:
         subprocess.run(['sudo', 'apt-get', 'update'], check=True)
-        subprocess.run(['sudo', 'apt-get', 'install', '-y', package], check=True)
+        subprocess.run(['sudo', 'apt-get', 'install', '-y', *packages], check=True)
         return True
     except subprocess.CalledProcessError:
         return False
@@ -38,31 +49,43 @@ def main():
     # Python packages
     python_packages = [
         'pydub',
-        'ffmpeg-python'
+        'ffmpeg-python',
+        'pyfluidsynth',
+        'mido',
+        'lameenc'
     ]
     
-    print("\nInstalling Python packages...")
-    for package in python_packages:
-        print(f"Installing {package}...")
-        if install_package(package):
-            print(f"✓ {package} installed successfully")
+    # One pip run resolves and downloads everything together; concurrent pip
+    # processes writing into the same site-packages are not safe
+    missing_python = [p for p in python_packages if need(p)]
+    if not missing_python:
+        print("\n✓ Python packages are already installed")
+    else:
+        print(f"\nInstalling Python packages: {', '.join(missing_python)}...")
+        if install_packages(missing_python):
+            print("✓ Python packages installed successfully")
         else:
-            print(f"✗ Failed to install {package}")
+            print("✗ Failed to install Python packages")
     
     # System packages
     system_packages = ['timidity', 'fluidsynth']
     
     print("\nChecking system packages...")
+    missing_packages = []
     for package in system_packages:
         if check_system_package(package):
             print(f"✓ {package} is already installed")
         else:
-            print(f"Installing {package}...")
-            if install_system_package(package):
-                print(f"✓ {package} installed successfully")
-            else:
-                print(f"✗ Failed to install {package}")
-                print(f"Please install {package} manually: sudo apt-get install {package}")
+            missing_packages.append(package)
+    
+    # apt-get holds the dpkg lock, so install everything missing in one run
+    if missing_packages:
+        print(f"Installing {', '.join(missing_packages)}...")
+        if install_system_packages(missing_packages):
+            print(f"✓ {', '.join(missing_packages)} installed successfully")
+        else:
+            print(f"✗ Failed to install {', '.join(missing_packages)}")
+            print(f"Please install manually: sudo apt-get install {' '.join(missing_packages)}")
     
     print("\n=== Installation Complete ===")
     print("You can now use the enhanced MP3 generator!")
@@ -0,0 +1,344 @@
+"""
+Shared note-event helpers and MIDI to MP3 rendering backend
+"""
+
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import numpy as np
+
+import mido
+
+# In-process synthesis is optional; without it we shell out to timidity/fluidsynth
+try:
+    import fluidsynth
+except ImportError:
+    fluidsynth = None
+
+try:
+    import lameenc
+except ImportError:
+    lameenc = None
+
+try:
+    from pydub import AudioSegment
+except ImportError:
+    AudioSegment = None
+
+SOUNDFONT = '/usr/share/sounds/sf2/FluidR3_GM.sf2'
+SAMPLE_RATE = 44100
+TICKS_PER_BEAT = 480
+
+_PITCH_CLASSES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+_ACCIDENTALS = {'': 0, '#': 1, 'b': -1, '-': -1}
+# Note names without an octave sit in octave 4, e.g. 'C' -> 60, 'Bb' -> 70
+_MIDI_NUMBERS = {step + accidental: 60 + pitch_class + shift
+                 for step, pitch_class in _PITCH_CLASSES.items()
+                 for accidental, shift in _ACCIDENTALS.items()}
+
+# Resolve the external MIDI renderer once, rather than probing it on every call
+_MIDI_BACKEND = 'timidity' if shutil.which('timidity') else ('fluidsynth' if shutil.which('fluidsynth') else None)
+
+_synth = None
+_synth_pid = None
+
+def get_synth():
+    """Return this process's long-lived in-process synthesizer, or None if unavailable"""
+    global _synth, _synth_pid
+    # A synthesizer inherited through fork belongs to the parent; build a fresh one
+    if _synth_pid != os.getpid():
+        _synth, _synth_pid = None, os.getpid()
+        if fluidsynth is not None and os.path.exists(SOUNDFONT):
+            synth = fluidsynth.Synth(samplerate=float(SAMPLE_RATE))
+            sfid = synth.sfload(SOUNDFONT)
+            if sfid != -1:
+                for channel in range(16):
+                    synth.program_select(channel, sfid, 128 if channel == 9 else 0, 0)
+                _synth = synth
+    return _synth
+
+def synth_available():
+    """Check whether in-process rendering can work, without loading the soundfont"""
+    return fluidsynth is not None and os.path.exists(SOUNDFONT)
+
+def converter_available():
+    """Check whether any MIDI to MP3 path is usable"""
+    return synth_available() or _MIDI_BACKEND is not None
+
+def note_number(pitch):
+    """Translate a note name ('C#', 'Bb', 'E-5') or pitch number to a MIDI note number"""
+    if isinstance(pitch, int):
+        # Small integers are pitch classes, placed in octave 4 like music21 does
+        return pitch if pitch >= 12 else 60 + pitch
+    if pitch in _MIDI_NUMBERS:
+        return _MIDI_NUMBERS[pitch]
+    name = pitch.rstrip('0123456789')
+    return _MIDI_NUMBERS[name] + (int(pitch[len(name):]) - 4) * 12
+
+def sample_patterns(scales, n, single_ratio):
+    """Draw n ('n', name) single notes or ('c', [names]) 2-4 note chords from a scale"""
+    # Decide every row up front, then draw each kind in bulk C-level calls
+    is_chord = random.choices((True, False), (1 - single_ratio, single_ratio), k=n)
+    n_chords = is_chord.count(True)
+    singles = iter(random.choices(scales, k=n - n_chords))
+    chords = iter([random.sample(scales, size)
+                   for size in random.choices((2, 3, 4), k=n_chords)])
+
+    return [('c', next(chords)) if chord_row else ('n', next(singles))
+            for chord_row in is_chord]
+
+def as_events(notes):
+    """Adapt legacy '.'-joined string patterns to (kind, payload) tuples"""
+    for pattern in notes:
+        if not isinstance(pattern, str):
+            yield pattern
+        elif ('.' in pattern) or pattern.isdigit():
+            yield 'c', [int(current_note) if current_note.isdigit() else current_note
+                        for current_note in pattern.split('.')]
+        else:
+            yield 'n', pattern
+
+def write_midi(events, filename, step=0.5, duration=1.0, velocity=90):
+    """Write (kind, payload) note events to a single-track piano MIDI file"""
+    step_ticks = int(step * TICKS_PER_BEAT)
+    duration_ticks = int(duration * TICKS_PER_BEAT)
+
+    # Absolute (tick, is_on, note) triples; notes overlap, so order them before taking deltas
+    timeline = []
+    for i, (kind, payload) in enumerate(events):
+        start = i * step_ticks
+        for pitch in (payload if kind == 'c' else [payload]):
+            number = note_number(pitch)
+            timeline.append((start, 1, number))
+            timeline.append((start + duration_ticks, 0, number))
+    # At equal ticks note_off (0) sorts before note_on (1)
+    timeline.sort()
+
+    track = mido.MidiTrack()
+    track.append(mido.Message('program_change', program=0, time=0))
+    now = 0
+    for tick, is_on, number in timeline:
+        track.append(mido.Message('note_on' if is_on else 'note_off',
+                                  note=number, velocity=velocity, time=tick - now))
+        now = tick
+
+    midi = mido.MidiFile(ticks_per_beat=TICKS_PER_BEAT)
+    midi.tracks.append(track)
+    midi.save(filename)
+    return filename
+
+def render_midi_to_pcm(midi_file, tail=1.0):
+    """Render a MIDI file to an in-memory 16-bit stereo PCM buffer"""
+    synth = get_synth()
+    midi = mido.MidiFile(midi_file)
+    n_frames = int((midi.length + tail) * SAMPLE_RATE)
+    pcm = np.empty((n_frames, 2), dtype=np.int16)
+
+    position = 0
+    elapsed = 0.0
+    for msg in midi:
+        # Iterating a MidiFile yields delta times in seconds
+        elapsed += msg.time
+        target = min(int(elapsed * SAMPLE_RATE), n_frames)
+        if target > position:
+            pcm[position:target] = synth.get_samples(target - position).reshape(-1, 2)
+            position = target
+
+        if msg.type == 'note_on' and msg.velocity > 0:
+            synth.noteon(msg.channel, msg.note, msg.velocity)
+        elif msg.type in ('note_on', 'note_off'):
+            synth.noteoff(msg.channel, msg.note)
+        elif msg.type == 'program_change':
+            synth.program_change(msg.channel, msg.program)
+        elif msg.type == 'control_change':
+            synth.cc(msg.channel, msg.control, msg.value)
+
+    # Let the last notes ring out
+    if n_frames > position:
+        pcm[position:] = synth.get_samples(n_frames - position).reshape(-1, 2)
+
+    return pcm
+
+def encode_mp3(pcm_int16, rate, channels, out_path):
+    """Encode a 16-bit PCM buffer to MP3, with lameenc when available"""
+    if lameenc is None:
+        audio = AudioSegment(data=pcm_int16.tobytes(), sample_width=2,
+                             frame_rate=rate, channels=channels)
+        audio.export(out_path, format="mp3", parameters=["-q:a", "2"])
+        return
+
+    encoder = lameenc.Encoder()
+    encoder.set_in_sample_rate(rate)
+    encoder.set_channels(channels)
+    encoder.set_quality(3)
+    # VBR spends fewer bits (and less encoder work) on quiet passages
+    encoder.set_vbr(lameenc.VBR_MTRH)
+    encoder.set_vbr_quality(2)
+    data = encoder.encode(pcm_int16.tobytes()) + encoder.flush()
+    with open(out_path, 'wb') as f:
+        f.write(data)
+
+def pipe_to_mp3(synth_cmd, input_format, mp3_file):
+    """Stream a synthesizer's stdout straight into ffmpeg's MP3 encoder"""
+    synth = subprocess.Popen(synth_cmd, stdout=subprocess.PIPE)
+    try:
+        encoder = subprocess.Popen(['ffmpeg', '-loglevel', 'quiet', '-y', *input_format,
+                                    '-i', 'pipe:0', '-c:a', 'libmp3lame', '-q:a', '2', mp3_file],
+                                   stdin=synth.stdout)
+    except BaseException:
+        # Nobody will drain the pipe, so the synthesizer would block on it forever
+        synth.stdout.close()
+        synth.kill()
+        synth.wait()
+        raise
+    # Only ffmpeg should hold the read end, so the synthesizer sees SIGPIPE if ffmpeg exits
+    synth.stdout.close()
+    encoder.wait()
+    synth.wait()
+
+    if synth.returncode != 0:
+        raise subprocess.CalledProcessError(synth.returncode, synth_cmd)
+    if encoder.returncode != 0:
+        raise subprocess.CalledProcessError(encoder.returncode, 'ffmpeg')
+
+def fifo_to_mp3(make_synth_cmd, input_format, mp3_file):
+    """Stream a synthesizer's output file into ffmpeg through a named pipe"""
+    if not hasattr(os, 'mkfifo'):
+        # No named pipes on this platform; let the synthesizer write to stdout instead
+        return pipe_to_mp3(make_synth_cmd('-'), input_format, mp3_file)
+
+    fifo_dir = tempfile.mkdtemp()
+    fifo = os.path.join(fifo_dir, 'audio.fifo')
+    os.mkfifo(fifo)
+    try:
+        # ffmpeg encodes while the synthesizer is still rendering
+        encoder = subprocess.Popen(['ffmpeg', '-loglevel', 'quiet', '-y', *input_format,
+                                    '-i', fifo, '-c:a', 'libmp3lame', '-q:a', '2', mp3_file])
+        synth_cmd = make_synth_cmd(fifo)
+        try:
+            synth = subprocess.Popen(synth_cmd)
+        except BaseException:
+            # ffmpeg would otherwise stay blocked opening a pipe nobody writes to
+            encoder.kill()
+            encoder.wait()
+            raise
+        if synth.wait() != 0:
+            # ffmpeg may still be blocked opening the pipe
+            encoder.kill()
+            encoder.wait()
+            raise subprocess.CalledProcessError(synth.returncode, synth_cmd)
+        if encoder.wait() != 0:
+            raise subprocess.CalledProcessError(encoder.returncode, 'ffmpeg')
+    finally:
+        shutil.rmtree(fifo_dir, ignore_errors=True)
+
+def _synth_command(backend, midi_file, output):
+    """Build the command rendering midi_file to output, plus ffmpeg's matching input format"""
+    if backend == 'timidity':
+        return ['timidity', midi_file, '-Ow', '-o', output], ['-f', 'wav']
+    return (['fluidsynth', '-ni', SOUNDFONT, midi_file,
+             '-F', output, '-T', 'raw', '-O', 's16', '-r', str(SAMPLE_RATE)],
+            ['-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', '2'])
+
+def timidity_to_mp3(midi_file, mp3_file):
+    """Convert MIDI to MP3 with the timidity binary"""
+    pipe_to_mp3(*_synth_command('timidity', midi_file, '-'), mp3_file)
+
+def fluidsynth_to_mp3(midi_file, mp3_file):
+    """Convert MIDI to MP3 with the fluidsynth binary"""
+    # fluidsynth renders to a path, so hand it a named pipe rather than a WAV file
+    input_format = _synth_command('fluidsynth', midi_file, '-')[1]
+    fifo_to_mp3(lambda output: _synth_command('fluidsynth', midi_file, output)[0],
+                input_format, mp3_file)
+
+def render_midi_to_mp3(midi_path, mp3_path):
+    """Convert MIDI to MP3 using the fastest available path"""
+    # Render and encode in memory when pyFluidSynth is available, no temporary WAV needed
+    if get_synth() is not None:
+        try:
+            pcm = render_midi_to_pcm(midi_path)
+            encode_mp3(pcm, SAMPLE_RATE, 2, mp3_path)
+            return True
+        except Exception as e:
+            print(f"In-process rendering failed ({e}), falling back to external converter...")
+
+    if not _MIDI_BACKEND:
+        print("Error: No MIDI converter available. Please install timidity or fluidsynth.")
+        return False
+
+    try:
+        if _MIDI_BACKEND == 'timidity':
+            print("Using timidity for MIDI to MP3 conversion...")
+            timidity_to_mp3(midi_path, mp3_path)
+        else:
+            print("Using fluidsynth for MIDI to MP3 conversion...")
+            fluidsynth_to_mp3(midi_path, mp3_path)
+        return True
+
+    except Exception as e:
+        print(f"Error during conversion: {e}")
+        return False
+
+def render_many_to_mp3(jobs):
+    """Convert several (midi_path, mp3_path) pairs, sharing one ffmpeg process across all of them"""
+    # In-process rendering has no encoder start-up cost to share
+    if synth_available() or not _MIDI_BACKEND or not hasattr(os, 'mkfifo'):
+        return all([render_midi_to_mp3(midi_path, mp3_path) for midi_path, mp3_path in jobs])
+
+    print(f"Using {_MIDI_BACKEND} with a single ffmpeg pass for {len(jobs)} files...")
+    fifo_dir = tempfile.mkdtemp()
+    synth_cmds = []
+    ffmpeg_cmd = ['ffmpeg', '-loglevel', 'quiet', '-y']
+    try:
+        # Each synthesizer streams into its own named pipe, all read by one ffmpeg
+        for i, (midi_path, _) in enumerate(jobs):
+            fifo = os.path.join(fifo_dir, f'audio{i}.fifo')
+            os.mkfifo(fifo)
+            synth_cmd, input_format = _synth_command(_MIDI_BACKEND, midi_path, fifo)
+            synth_cmds.append(synth_cmd)
+            ffmpeg_cmd += [*input_format, '-i', fifo]
+        for i, (_, mp3_path) in enumerate(jobs):
+            ffmpeg_cmd += ['-map', f'{i}:a', '-c:a', 'libmp3lame', '-q:a', '2', mp3_path]
+
+        processes = []
+        try:
+            processes.append(subprocess.Popen(ffmpeg_cmd))
+            for synth_cmd in synth_cmds:
+                processes.append(subprocess.Popen(synth_cmd))
+        except OSError as e:
+            # ffmpeg would otherwise stay blocked opening a pipe nobody writes to
+            for process in processes:
+                process.kill()
+                process.wait()
+            print(f"Error during conversion: {e}")
+            return False
+        encoder, *synths = processes
+
+        # Poll rather than wait in order: if one synthesizer dies before opening its
+        # pipe, ffmpeg and the remaining synthesizers would otherwise block forever
+        while encoder.poll() is None:
+            if any(synth.poll() for synth in synths):
+                for process in [encoder, *synths]:
+                    process.kill()
+                    process.wait()
+                print("Error during conversion: synthesizer failed")
+                return False
+            time.sleep(0.05)
+
+        if encoder.returncode != 0:
+            # Synthesizers whose pipe ffmpeg never opened would wait on it forever
+            for synth in synths:
+                synth.kill()
+                synth.wait()
+            print("Error during conversion: ffmpeg failed")
+            return False
+        if any([synth.wait() for synth in synths]):
+            print("Error during conversion: synthesizer failed")
+            return False
+        return True
+
+    finally:
+        shutil.rmtree(fifo_dir, ignore_errors=True)
@@ -3,25 +3,21 @@
 Music Generation Script - Run the Jazz Music Generation
 """
 
+import os
 import sys
 import re
+import hashlib
+import itertools
+from functools import lru_cache
 import numpy as np
 import pandas as pd
 import music21
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import IPython
 from tqdm import tqdm
 import pickle
 
-# Fix the import issue
-try:
-    from tensorflow.keras.utils import to_categorical
-except ImportError:
-    try:
-        from keras.utils import to_categorical
-    except ImportError:
-        from keras.utils.np_utils import to_categorical
-
 import play
 from music21 import converter, instrument, note, chord, stream
 
@@ -30,89 +26,155 @@ try:
     from tensorflow.keras.models import Sequential
     from tensorflow.keras.layers import Activation, Dense, LSTM, Dropout, Flatten
     from tensorflow.keras.callbacks import ModelCheckpoint
+    from tensorflow.keras import mixed_precision
 except ImportError:
     from keras.models import Sequential
     from keras.layers import Activation, Dense, LSTM, Dropout, Flatten
     from keras.callbacks import ModelCheckpoint
+    from keras import mixed_precision
+
+# Run layers in float16 with float32 weights where tensor cores exist;
+# on CPU half precision is slower than float32, so keep the default there
+try:
+    import tensorflow as tf
+    if tf.config.list_physical_devices('GPU'):
+        mixed_precision.set_global_policy('mixed_float16')
+except ImportError:
+    tf = None
 
 # Get songs
 songs = glob('Jazz/*.mid')
 songs = songs[:3]
 
-def get_notes():
+_NOTES_CACHE_DIR = os.path.join('data', 'notes_cache')
+
+def _parse_notes(data):
+    """Extract note and chord tokens from the bytes of a MIDI file"""
     notes = []
-    for file in songs:
-        # converting .mid file to stream object
-        midi = converter.parse(file)
-        notes_to_parse = []
-        try:
-            # Given a single stream, partition into a part for each unique instrument
-            parts = instrument.partitionByInstrument(midi)
-        except:
-            pass
-        if parts: # if parts has instrument parts 
-            notes_to_parse = parts.parts[0].recurse()
-        else:
-            notes_to_parse = midi.flat.notes
-    
-        for element in notes_to_parse: 
-            if isinstance(element, note.Note):
-                # if element is a note, extract pitch
-                notes.append(str(element.pitch))
-            elif(isinstance(element, chord.Chord)):
-                # if element is a chord, append the normal form of the 
-                # chord (a list of integers) to the list of notes. 
-                notes.append('.'.join(str(n) for n in element.normalOrder))
-    
-    with open('data/notes', 'wb') as filepath:
-        pickle.dump(notes, filepath)
-    
+    # converting .mid data to stream object. Keep music21's default quantization:
+    # its grid also sets how close note onsets must be to merge into one chord
+    midi = converter.parseData(data, format='midi')
+    parts = None
+    try:
+        # Given a single stream, partition into a part for each unique instrument
+        parts = instrument.partitionByInstrument(midi)
+    except:
+        pass
+    if parts: # if parts has instrument parts 
+        # only visit notes and chords, skipping rests, clefs, meters etc.
+        notes_to_parse = parts.parts[0].recurse().notes
+    else:
+        notes_to_parse = midi.flat.notes
+
+    for element in notes_to_parse: 
+        if element.isNote:
+            # if element is a note, extract pitch
+            notes.append(element.nameWithOctave)
+        elif(isinstance(element, chord.Chord)):
+            # if element is a chord, append the normal form of the 
+            # chord (a list of integers) to the list of notes. 
+            notes.append('.'.join(str(n) for n in element.normalOrder))
     return notes
 
-def prepare_sequences(notes, n_vocab): 
-    sequence_length = 100
+def _notes_cache_file(path):
+    """Return the cache file for a MIDI file's tokens, keyed on its path, mtime and size"""
+    key = hashlib.sha1(f"{path}:{os.path.getmtime(path)}:{os.path.getsize(path)}".encode()).hexdigest()
+    return os.path.join(_NOTES_CACHE_DIR, f'{key}.pkl')
 
-    # Extract the unique pitches in the list of notes.
-    pitchnames = sorted(set(item for item in notes))
+def _read_file(path):
+    with open(path, 'rb') as filepath:
+        return filepath.read()
 
-    # Create a dictionary to map pitches to integers
-    note_to_int = dict((note, number) for number, note in enumerate(pitchnames))
+def _notes_for_data(data, cache_file):
+    """Parse MIDI bytes and cache the extracted tokens"""
+    notes = _parse_notes(data)
+    # Go through a temporary file so readers never see a partial pickle
+    os.makedirs(_NOTES_CACHE_DIR, exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'wb') as filepath:
+        pickle.dump(notes, filepath, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+    return notes
 
-    network_input = []
-    network_output = []
+def _load_cached_notes(cache_file):
+    """Return cached tokens, or None when the entry is missing or unreadable"""
+    try:
+        with open(cache_file, 'rb') as filepath:
+            return pickle.load(filepath)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
 
-    # create input sequences and the corresponding outputs
-    for i in range(0, len(notes) - sequence_length, 1):
-        sequence_in = notes[i: i + sequence_length]
-        sequence_out = notes[i + sequence_length]
-        network_input.append([note_to_int[char] for char in sequence_in])
-        network_output.append(note_to_int[sequence_out])
+def get_notes():
+    notes_per_song = [None] * len(songs)
+    pending = []
+    for index, file in enumerate(songs):
+        cache_file = _notes_cache_file(file)
+        notes_per_song[index] = _load_cached_notes(cache_file)
+        if notes_per_song[index] is None:
+            pending.append((index, file, cache_file))
+
+    if pending:
+        # Read the files on threads and hand each one to a parser process as soon
+        # as it is in memory, so disk reads overlap with music21's CPU-bound parsing
+        with ThreadPoolExecutor(max_workers=8) as readers, \
+                ProcessPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1)) as parsers:
+            reads = [readers.submit(_read_file, file) for _, file, _ in pending]
+            parses = [parsers.submit(_notes_for_data, read.result(), cache_file)
+                      for read, (_, _, cache_file) in zip(reads, pending)]
+            for (index, _, _), parse in zip(pending, parses):
+                notes_per_song[index] = parse.result()
+
+    notes = list(itertools.chain.from_iterable(notes_per_song))
     
-    n_patterns = len(network_input)
+    # store the vocabulary and the integer-encoded sequence instead of the strings
+    pitchnames = sorted(set(notes))
+    note_to_int = dict((note, number) for number, note in enumerate(pitchnames))
+    # int16 indices cover any realistic vocabulary at half the size of int32
+    dtype = np.int16 if len(pitchnames) <= np.iinfo(np.int16).max + 1 else np.int32
+    int_notes = np.fromiter((note_to_int[char] for char in notes), dtype=dtype, count=len(notes))
+    np.savez_compressed('data/notes.npz', ints=int_notes, pitchnames=np.array(pitchnames))
     
+    return pitchnames, int_notes
+
+def prepare_sequences(int_notes, n_vocab): 
+    sequence_length = 100
+
+    # take every sequence as a window over the encoded notes
+    windows = np.lib.stride_tricks.sliding_window_view(int_notes, sequence_length)[:-1]
+
+    # create input sequences and the corresponding outputs
+    network_output = int_notes[sequence_length:]
+
     # reshape the input into a format comatible with LSTM layers 
-    network_input = np.reshape(network_input, (n_patterns, sequence_length, 1))
+    network_input = windows[..., None]
     
-    # normalize input
-    network_input = network_input / float(n_vocab)
+    # normalize input in float32, the dtype the LSTM consumes
+    network_input = network_input.astype(np.float32)
+    network_input *= np.float32(1.0 / n_vocab)
     
-    # one hot encode the output vectors
-    network_output = to_categorical(network_output)
+    # keep the outputs as class indices for the sparse loss
+    network_output = network_output.astype(np.int32, copy=False)
     
     return (network_input, network_output)
 
+# Arguments the fused cuDNN LSTM kernel requires; changing any of them makes
+# Keras fall back to the much slower generic implementation on GPU
+_CUDNN_LSTM_ARGS = dict(activation='tanh', recurrent_activation='sigmoid',
+                        recurrent_dropout=0.0, unroll=False, use_bias=True)
+
 def create_network(network_in, n_vocab): 
     """Create the model architecture"""
     model = Sequential()
-    model.add(LSTM(128, input_shape=network_in.shape[1:], return_sequences=True))
+    model.add(LSTM(128, input_shape=network_in.shape[1:], return_sequences=True, **_CUDNN_LSTM_ARGS))
     model.add(Dropout(0.2))
-    model.add(LSTM(128, return_sequences=True))
+    model.add(LSTM(128, return_sequences=True, **_CUDNN_LSTM_ARGS))
     model.add(Flatten())
     model.add(Dense(256))
     model.add(Dropout(0.3))
-    model.add(Dense(n_vocab))
-    model.add(Activation('softmax'))
-    model.compile(loss='categorical_crossentropy', optimizer='adam')
+    # keep the output layers in float32 for a numerically stable softmax
+    model.add(Dense(n_vocab, dtype='float32'))
+    model.add(Activation('softmax', dtype='float32'))
+    model.compile(loss='sparse_categorical_crossentropy', optimizer='adam')
     return model
 
 def train(model, network_input, network_output, epochs): 
@@ -123,7 +185,16 @@ def train(model, network_input, network_output, epochs):
     filepath = 'weights.best.music3.hdf5'
     checkpoint = ModelCheckpoint(filepath, monitor='loss', verbose=0, save_best_only=True)
     
-    model.fit(network_input, network_output, epochs=epochs, batch_size=32, callbacks=[checkpoint])
+    if tf is None:
+        model.fit(network_input, network_output, epochs=epochs, batch_size=32, callbacks=[checkpoint])
+        return
+
+    # Shuffle and batch on the host while the previous step is still training
+    dataset = (tf.data.Dataset.from_tensor_slices((network_input, network_output))
+               .shuffle(len(network_input), reshuffle_each_iteration=True)
+               .batch(32)
+               .prefetch(tf.data.AUTOTUNE))
+    model.fit(dataset, epochs=epochs, callbacks=[checkpoint])
 
 def train_network():
     """
@@ -136,13 +207,13 @@ def train_network():
     epochs = 200
     
     print("Getting notes from MIDI files...")
-    notes = get_notes()
-    print(f'Notes processed: {len(notes)} notes extracted')
+    pitchnames, int_notes = get_notes()
+    print(f'Notes processed: {len(int_notes)} notes extracted')
     
-    n_vocab = len(set(notes))
+    n_vocab = len(pitchnames)
     print(f'Vocabulary generated: {n_vocab} unique notes')
     
-    network_in, network_out = prepare_sequences(notes, n_vocab)
+    network_in, network_out = prepare_sequences(int_notes, n_vocab)
     print('Input and Output processed')
     
     model = create_network(network_in, n_vocab)
@@ -154,18 +225,12 @@ def train_network():
     
     return model
 
-def get_inputSequences(notes, pitchnames, n_vocab):
+def get_inputSequences(int_notes):
     """ Prepare the sequences used by the Neural Network """
-    # map between notes and integers and back
-    note_to_int = dict((note, number) for number, note in enumerate(pitchnames))
-
     sequence_length = 100
-    network_input = []
-    for i in range(0, len(notes) - sequence_length, 1):
-        sequence_in = notes[i:i + sequence_length]
-        network_input.append([note_to_int[char] for char in sequence_in])
+    network_input = np.lib.stride_tricks.sliding_window_view(int_notes, sequence_length)[:-1]
     
-    network_input = np.reshape(network_input, (len(network_input), 100, 1))
+    network_input = network_input[..., None]
     
     return (network_input)
 
@@ -176,48 +241,74 @@ def generate_notes(model, network_input, pitchnames, n_vocab):
 
     int_to_note = dict((number, note) for number, note in enumerate(pitchnames))
     
-    # pick a random sequence from the input as a starting point for the prediction
-    pattern = list(network_input[start])
+    # pick a random sequence from the input as a starting point for the prediction.
+    # The window lives twice in a ring buffer so the latest 100 notes are always
+    # the contiguous slice pattern[head:head + sequence_length]
+    sequence_length = network_input.shape[1]
+    pattern = np.empty(2 * sequence_length, dtype=np.float32)
+    pattern[:sequence_length] = pattern[sequence_length:] = network_input[start, :, 0]
+    head = 0
+    prediction_input = np.empty((1, sequence_length, 1), dtype=np.float32)
+    scale = np.float32(1.0 / n_vocab)
     prediction_output = []
+
+    # call the model directly; predict() rebuilds its input pipeline every step.
+    # With TensorFlow, trace the forward pass once for the fixed input shape.
+    # XLA cannot compile the cuDNN LSTM kernel, so only JIT-compile on CPU
+    if tf is not None:
+        jit_compile = not tf.config.list_physical_devices('GPU')
+        step = tf.function(lambda x: model(x, training=False), jit_compile=jit_compile,
+                           input_signature=[tf.TensorSpec(prediction_input.shape, tf.float32)])
+    else:
+        step = lambda x: model(x, training=False)
     
     print('Generating notes........')
 
     # generate 500 notes
     for note_index in range(500):
-        prediction_input = np.reshape(pattern, (1, len(pattern), 1))
-        prediction_input = prediction_input / float(n_vocab)
+        np.multiply(pattern[head:head + sequence_length], scale, out=prediction_input[0, :, 0])
 
-        prediction = model.predict(prediction_input, verbose=0)
+        prediction = np.asarray(step(prediction_input))
         
         # Predicted output is the argmax(P(h|D))
-        index = np.argmax(prediction)
+        index = int(np.argmax(prediction))
         # Mapping the predicted interger back to the corresponding note
         result = int_to_note[index]
         # Storing the predicted output
         prediction_output.append(result)
 
-        pattern.append(index)
-        # Next input to the model
-        pattern = pattern[1:len(pattern)]
+        # Next input to the model: overwrite the oldest note and move the window on
+        pattern[head] = pattern[head + sequence_length] = index
+        head = (head + 1) % sequence_length
 
     print('Notes Generated...')
     return prediction_output
 
+@lru_cache(maxsize=None)
+def _chord_pitches(pattern):
+    """Return the pitch numbers of a chord token, or None for a single note"""
+    if ('.' in pattern) or pattern.isdigit():
+        return tuple(int(current_note) for current_note in pattern.split('.'))
+    return None
+
 def create_midi(prediction_output):
     """ convert the output from the prediction to notes and create a midi file
         from the notes """
-    offset = 0
+    # one instrument marker is enough for every note
+    piano = instrument.Piano()
     output_notes = []
 
-    # create note and chord objects based on the values generated by the model
-    for pattern in prediction_output:
+    # create note and chord objects based on the values generated by the model,
+    # spacing them half a beat apart so that notes do not stack
+    for index, pattern in enumerate(prediction_output):
+        offset = index * 0.5
+        notes_in_chord = _chord_pitches(pattern)
         # pattern is a chord
-        if ('.' in pattern) or pattern.isdigit():
-            notes_in_chord = pattern.split('.')
+        if notes_in_chord is not None:
             notes = []
             for current_note in notes_in_chord:
-                new_note = note.Note(int(current_note))
-                new_note.storedInstrument = instrument.Piano()
+                new_note = note.Note(current_note)
+                new_note.storedInstrument = piano
                 notes.append(new_note)
             new_chord = chord.Chord(notes)
             new_chord.offset = offset
@@ -226,12 +317,10 @@ def create_midi(prediction_output):
         else:
             new_note = note.Note(pattern)
             new_note.offset = offset
-            new_note.storedInstrument = instrument.Piano()
+            new_note.storedInstrument = piano
             output_notes.append(new_note)
 
-        # increase offset each iteration so that notes do not stack
-        offset += 0.5
-
+    # build the stream once from the finished list rather than inserting one by one
     midi_stream = stream.Stream(output_notes)
     
     print('Saving Output file as midi....')
@@ -242,22 +331,21 @@ def generate():
     """ Generate a piano midi file """
     #load the notes used to train the model
     try:
-        with open('data/notes', 'rb') as filepath:
-            notes = pickle.load(filepath)
+        with np.load('data/notes.npz') as data:
+            int_notes = data['ints']
+            # Get all pitch names
+            pitchnames = data['pitchnames'].tolist()
     except FileNotFoundError:
         print("No saved notes found. Please run training first.")
         return
 
-    # Get all pitch names
-    pitchnames = sorted(set(item for item in notes))
-    # Get all pitch names
-    n_vocab = len(set(notes))
+    n_vocab = len(pitchnames)
     
     print('Initiating music generation process.......')
     
-    network_input = get_inputSequences(notes, pitchnames, n_vocab)
-    normalized_input = network_input / float(n_vocab)
-    model = create_network(normalized_input, n_vocab)
+    network_input = get_inputSequences(int_notes)
+    # the model only needs the input shape, so the windows need no normalizing here
+    model = create_network(network_input, n_vocab)
     print('Loading Model weights.....')
     
     try: